@@ -1,19 +1,26 @@
 import abc
+import itertools
 import logging
 import queue
 import threading
 import time
 
-from multiprocess import Queue
+from multiprocess import Pipe, Queue
 
 from ..SocketInterface import serversocket
 from ..utilities.multiprocess_utils import Process
 
 RECORD_TYPE_CONTENT = 'page_content'
 STATUS_TIMEOUT = 120  # seconds
+SOCKET_CLOSE_TIMEOUT = 30  # seconds
 SHUTDOWN_SIGNAL = 'SHUTDOWN'
 
 STATUS_UPDATE_INTERVAL = 5  # seconds
+BATCH_SIZE = 256  # max number of records pulled off the queue at once
+# Records held in memory before the listener stops reading from its sockets.
+# Above TaskManager.AGGREGATOR_QUEUE_LIMIT, so that the TaskManager throttles
+# command submission before crawlers are blocked.
+MAX_QUEUE_DEPTH = 20000
 
 
 class BaseListener(object):
@@ -33,12 +40,15 @@ class BaseListener(object):
         List of browser configuration dictionaries"""
     __metaclass = abc.ABCMeta
 
-    def __init__(self, status_queue, shutdown_queue, manager_params):
+    def __init__(self, status_queue, shutdown_conn, manager_params):
         self.status_queue = status_queue
-        self.shutdown_queue = shutdown_queue
+        self.shutdown_conn = shutdown_conn
         self._shutdown_flag = False
-        self._last_update = time.time()  # last status update time
+        self._last_update = time.monotonic()  # last status update time
+        self._last_full_count = 0  # times the record queue was full
+        self._handlers = dict()  # maps table_name to a record handler
         self.record_queue = None  # Initialized on `startup`
+        self._socket_shards = manager_params['aggregator_socket_shards']
         self.logger = logging.getLogger('openwpm')
 
     @abc.abstractmethod
@@ -51,6 +61,72 @@ class BaseListener(object):
             2-tuple in format (table_name, data). `data` is a dict which maps
             column name to the record for that column"""
 
+    def register_handler(self, table_name, handler):
+        """Handle records for `table_name` with `handler`.
+
+        Child classes should call `handle_record` before falling back to
+        their default storage.
+
+        Parameters
+        ----------
+        table_name : str
+            Table name of the records to handle
+        handler : callable
+            Called with the full (table_name, data) record"""
+        self._handlers[table_name] = handler
+
+    def handle_record(self, record):
+        """Pass `record` to the handler registered for its table, if any.
+
+        Parameters
+        ----------
+        record : tuple
+            2-tuple in format (table_name, data)
+
+        Returns
+        -------
+        bool
+            True if a handler was called for `record`"""
+        handler = self._handlers.get(record[0])
+        if handler is None:
+            return False
+        handler(record)
+        return True
+
+    def process_records(self, batch):
+        """Parse and save a list of records to persistent storage.
+
+        Consecutive records for the same table are passed to `flush_batch`
+        together. Records of the wrong length go to `process_record`.
+
+        Parameters
+        ----------
+        batch : list of tuple
+            List of records in the format expected by `process_record`"""
+        groups = itertools.groupby(
+            batch, key=lambda record: record[0] if len(record) == 2 else None)
+        for table_name, records in groups:
+            if table_name is None:
+                for record in records:
+                    self.process_record(record)
+                continue
+            self.flush_batch(table_name, [record[1] for record in records])
+
+    def flush_batch(self, table_name, rows):
+        """Save a list of records for `table_name` to persistent storage.
+
+        The default implementation calls `process_record` on each record.
+        Child classes can override this to write all rows in one operation.
+
+        Parameters
+        ----------
+        table_name : str
+            Table name shared by all rows
+        rows : list
+            The `data` part of each record, in the order received"""
+        for data in rows:
+            self.process_record((table_name, data))
+
     @abc.abstractmethod
     def process_content(self, record):
         """Parse and save page content `record` to persistent storage.
@@ -65,31 +141,44 @@ class BaseListener(object):
         """Run listener startup tasks
 
         Note: Child classes should call this method"""
-        self.sock = serversocket(name=type(self).__name__)
+        self.sock = serversocket(
+            name=type(self).__name__, nshards=self._socket_shards,
+            maxsize=MAX_QUEUE_DEPTH)
         self.status_queue.put(self.sock.sock.getsockname())
         self.sock.start_accepting()
         self.record_queue = self.sock.queue
 
     def should_shutdown(self):
         """Return `True` if the listener has received a shutdown signal"""
-        if not self.shutdown_queue.empty():
-            self.shutdown_queue.get()
+        if self.shutdown_conn.poll():
+            self.shutdown_conn.recv()
             self.logger.info("Received shutdown signal!")
             return True
         return False
 
     def update_status_queue(self):
         """Send manager process a status update."""
-        if (time.time() - self._last_update) < STATUS_UPDATE_INTERVAL:
+        now = time.monotonic()
+        if (now - self._last_update) < STATUS_UPDATE_INTERVAL:
             return
         qsize = self.record_queue.qsize()
         self.status_queue.put(qsize)
-        self.logger.debug(
-            "Status update; current record queue size: %d. "
-            "current number of threads: %d." %
-            (qsize, threading.active_count())
-        )
-        self._last_update = time.time()
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                "Status update; current record queue size: %d. "
+                "current number of threads: %d.",
+                qsize, threading.active_count()
+            )
+        full_count = self.sock.full_count
+        if full_count > self._last_full_count:
+            self.logger.info(
+                "Record queue reached its maximum size of %d records %d "
+                "times since the last status update. Reading from crawl "
+                "processes is paused while it is full.",
+                MAX_QUEUE_DEPTH, full_count - self._last_full_count
+            )
+            self._last_full_count = full_count
+        self._last_update = now
 
     def shutdown(self):
         """Run shutdown tasks defined in the base listener
@@ -97,12 +186,47 @@ class BaseListener(object):
         Note: Child classes should call this method"""
         self.sock.close()
 
+    def drain_batch(self):
+        """Return up to `BATCH_SIZE` records from the record queue without
+        blocking. The returned list is empty if the queue is empty."""
+        batch = list()
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self.record_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def stop_accepting(self):
+        """Stop accepting connections and wait for the open connections to
+        be closed by the crawl processes, so that all records sent before
+        shutdown are in the record queue. Records are processed while
+        waiting, since the socket stops reading while the queue is full.
+
+        Note: This should be called before the final `drain_queue`"""
+        self.sock.close()
+        deadline = time.monotonic() + SOCKET_CLOSE_TIMEOUT
+        while True:
+            batch = self.drain_batch()
+            if batch:
+                self.process_records(batch)
+            if self.sock.join(0 if batch else 0.1):
+                return
+            if time.monotonic() > deadline:
+                break
+        self.logger.error(
+            "Connections to the %s socket still open after %d seconds. "
+            "Records sent on them after this point will be lost.",
+            type(self).__name__, SOCKET_CLOSE_TIMEOUT
+        )
+
     def drain_queue(self):
         """ Ensures queue is empty before closing """
-        time.sleep(3)  # TODO: the socket needs a better way of closing
-        while not self.record_queue.empty():
-            record = self.record_queue.get()
-            self.process_record(record)
+        while True:
+            batch = self.drain_batch()
+            if not batch:
+                break
+            self.process_records(batch)
 
 
 class BaseAggregator(object):
@@ -125,7 +249,7 @@ class BaseAggregator(object):
         self.listener_address = None
         self.listener_process = None
         self.status_queue = Queue()
-        self.shutdown_queue = Queue()
+        self._shutdown_reader, self._shutdown_writer = Pipe(duplex=False)
         self._last_status = None
         self._last_status_received = None
         self.logger = logging.getLogger('openwpm')
@@ -150,15 +274,19 @@ class BaseAggregator(object):
             return self.get_status()
 
         # Drain status queue until we receive most recent update
-        while not self.status_queue.empty():
-            self._last_status = self.status_queue.get()
-            self._last_status_received = time.time()
+        while True:
+            try:
+                self._last_status = self.status_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._last_status_received = time.monotonic()
 
         # Check last status signal
-        if (time.time() - self._last_status_received) > STATUS_TIMEOUT:
+        elapsed = time.monotonic() - self._last_status_received
+        if elapsed > STATUS_TIMEOUT:
             raise RuntimeError(
                 "No status update from DataAggregator listener process "
-                "for %d seconds." % (time.time() - self._last_status_received)
+                "for %d seconds." % elapsed
             )
 
         return self._last_status
@@ -168,18 +296,22 @@ class BaseAggregator(object):
         try:
             self._last_status = self.status_queue.get(
                 block=True, timeout=STATUS_TIMEOUT)
-            self._last_status_received = time.time()
+            self._last_status_received = time.monotonic()
         except queue.Empty:
+            if self._last_status_received is None:
+                elapsed = STATUS_TIMEOUT
+            else:
+                elapsed = time.monotonic() - self._last_status_received
             raise RuntimeError(
                 "No status update from DataAggregator listener process "
-                "for %d seconds." % (time.time() - self._last_status_received)
+                "for %d seconds." % elapsed
             )
         return self._last_status
 
     def launch(self, listener_process_runner, *args):
         """Launch the aggregator listener process"""
         args = (self.manager_params, self.status_queue,
-                self.shutdown_queue) + args
+                self._shutdown_reader) + args
         self.listener_process = Process(
             target=listener_process_runner,
             args=args
@@ -194,7 +326,7 @@ class BaseAggregator(object):
             "Sending the shutdown signal to the %s listener process..." %
             type(self).__name__
         )
-        self.shutdown_queue.put(SHUTDOWN_SIGNAL)
+        self._shutdown_writer.send(SHUTDOWN_SIGNAL)
         start_time = time.time()
         self.listener_process.join(300)
         self.logger.debug(
@@ -1,5 +1,6 @@
 
 import base64
+import itertools
 import json
 import os
 import sqlite3
@@ -19,10 +20,10 @@ LDB_NAME = 'content.ldb'
 
 
 def listener_process_runner(
-        manager_params, status_queue, shutdown_queue, ldb_enabled):
+        manager_params, status_queue, shutdown_conn, ldb_enabled):
     """LocalListener runner. Pass to new process"""
     listener = LocalListener(
-        status_queue, shutdown_queue, manager_params, ldb_enabled)
+        status_queue, shutdown_conn, manager_params, ldb_enabled)
     listener.startup()
 
     while True:
@@ -35,13 +36,13 @@ def listener_process_runner(
             listener.maybe_commit_records()
             continue
 
-        # Process record
-        record = listener.record_queue.get()
-        listener.process_record(record)
+        # Process all records currently available, in batches
+        listener.process_records(listener.drain_batch())
 
         # batch commit if necessary
         listener.maybe_commit_records()
 
+    listener.stop_accepting()
     listener.drain_queue()
     listener.shutdown()
 
@@ -50,7 +51,7 @@ class LocalListener(BaseListener):
     """Listener that interfaces with a local SQLite database."""
 
     def __init__(
-            self, status_queue, shutdown_queue, manager_params, ldb_enabled):
+            self, status_queue, shutdown_conn, manager_params, ldb_enabled):
         db_path = manager_params['database_name']
         self.db = sqlite3.connect(db_path, check_same_thread=False)
         self.cur = self.db.cursor()
@@ -67,7 +68,9 @@ class LocalListener(BaseListener):
         self._sql_counter = 0
         self._sql_commit_time = 0
         super(LocalListener, self).__init__(
-            status_queue, shutdown_queue, manager_params)
+            status_queue, shutdown_conn, manager_params)
+        self.register_handler("create_table", self._create_table)
+        self.register_handler(RECORD_TYPE_CONTENT, self.process_content)
 
     def _generate_insert(self, table, data):
         """Generate a SQL query from `record`"""
@@ -89,31 +92,76 @@ class LocalListener(BaseListener):
         if len(record) != 2:
             self.logger.error("Query is not the correct length")
             return
-        if record[0] == "create_table":
-            self.cur.execute(record[1])
-            self.db.commit()
-            return
-        elif record[0] == RECORD_TYPE_CONTENT:
-            self.process_content(record)
+        if self.handle_record(record):
             return
         statement, args = self._generate_insert(
             table=record[0], data=record[1])
-        for i in range(len(args)):
-            if isinstance(args[i], bytes):
-                args[i] = str(args[i], errors='ignore')
-            elif callable(args[i]):
-                args[i] = str(args[i])
-            elif type(args[i]) == dict:
-                print(args[i])
-                args[i] = json.dumps(args[i])
+        self._execute(
+            statement, [self._convert_value(value) for value in args])
+
+    def _execute(self, statement, args):
+        """Execute `statement` with `args`, logging unsupported records"""
         try:
             self.cur.execute(statement, args)
             self._sql_counter += 1
         except (OperationalError, ProgrammingError,
                 IntegrityError, InterfaceError) as e:
             self.logger.error(
-                "Unsupported record:\n%s\n%s\n%s\n%s\n"
-                % (type(e), e, statement, repr(args)))
+                "Unsupported record:\n%s\n%s\n%s\n%r\n",
+                type(e), e, statement, args)
+
+    def flush_batch(self, table_name, rows):
+        """Add `rows` to the database with one `executemany` per run of
+        rows that share the same columns"""
+        rows = [data for data in rows
+                if not self.handle_record((table_name, data))]
+        for _, group in itertools.groupby(rows, key=lambda data: list(data)):
+            group = list(group)
+            statement, _ = self._generate_insert(
+                table=table_name, data=group[0])
+            self._insert_many(statement, [
+                [self._convert_value(value) for value in data.values()]
+                for data in group
+            ])
+
+    def _insert_many(self, statement, args_list):
+        """Execute `statement` for each of `args_list`. Rows which fail are
+        logged and skipped, as in `process_record`."""
+        rows = iter(args_list)
+        try:
+            self.cur.executemany(statement, rows)
+            self._sql_counter += len(args_list)
+            return
+        except (OperationalError, ProgrammingError,
+                IntegrityError, InterfaceError) as e:
+            # `executemany` consumes `rows` one at a time, so the rows
+            # before the last one consumed were inserted and the last one
+            # failed. If the statement itself is invalid no row is consumed.
+            remaining = list(rows)
+            failed = len(args_list) - len(remaining)
+            if failed > 0:
+                self._sql_counter += failed - 1
+                self.logger.error(
+                    "Unsupported record:\n%s\n%s\n%s\n%r\n",
+                    type(e), e, statement, args_list[failed - 1])
+        for args in remaining:
+            self._execute(statement, args)
+
+    @staticmethod
+    def _convert_value(value):
+        """Convert `value` to a type supported by SQLite"""
+        if isinstance(value, bytes):
+            return str(value, errors='ignore')
+        elif callable(value):
+            return str(value)
+        elif type(value) == dict:
+            return json.dumps(value)
+        return value
+
+    def _create_table(self, record):
+        """Execute the CREATE TABLE statement in `record`"""
+        self.cur.execute(record[1])
+        self.db.commit()
 
     def process_content(self, record):
         """Add page content to the LevelDB database"""
@@ -4,6 +4,7 @@ import gzip
 import hashlib
 import io
 import json
+import logging
 import queue
 import random
 import time
@@ -35,10 +36,10 @@ S3_CONFIG = Config(**S3_CONFIG_KWARGS)
 
 
 def listener_process_runner(
-        manager_params, status_queue, shutdown_queue, instance_id):
+        manager_params, status_queue, shutdown_conn, instance_id):
     """S3Listener runner. Pass to new process"""
     listener = S3Listener(
-        status_queue, shutdown_queue, manager_params, instance_id)
+        status_queue, shutdown_conn, manager_params, instance_id)
     listener.startup()
 
     while True:
@@ -48,10 +49,11 @@ def listener_process_runner(
             break
         try:
             record = listener.record_queue.get(block=True, timeout=5)
-            listener.process_record(record)
         except queue.Empty:
-            pass
+            continue
+        listener.process_records([record] + listener.drain_batch())
 
+    listener.stop_accepting()
     listener.drain_queue()
     listener.shutdown()
 
@@ -66,7 +68,7 @@ class S3Listener(BaseListener):
     """
 
     def __init__(
-            self, status_queue, shutdown_queue, manager_params, instance_id):
+            self, status_queue, shutdown_conn, manager_params, instance_id):
         self.dir = manager_params['s3_directory']
         self.browser_map = dict()  # maps crawl_id to visit_id
         self._records = dict()  # maps visit_id and table to records
@@ -84,7 +86,9 @@ class S3Listener(BaseListener):
             self._bucket, self.dir)
         self._last_record_received = None  # time last record was received
         super(S3Listener, self).__init__(
-            status_queue, shutdown_queue, manager_params)
+            status_queue, shutdown_conn, manager_params)
+        self.register_handler("create_table", lambda record: None)  # drop
+        self.register_handler(RECORD_TYPE_CONTENT, self.process_content)
 
     def _get_records(self, visit_id):
         """Get the RecordBatch corresponding to `visit_id`"""
@@ -119,7 +123,7 @@ class S3Listener(BaseListener):
                 self._batches[table_name].append(batch)
                 self.logger.debug(
                     "Successfully created batch for table %s and "
-                    "visit_id %s" % (table_name, visit_id)
+                    "visit_id %s", table_name, visit_id
                 )
             except pa.lib.ArrowInvalid:
                 self.logger.error(
@@ -143,7 +147,7 @@ class S3Listener(BaseListener):
         # Check local filename cache
         if filename.split('/', 1)[1] in self._s3_content_cache:
             self.logger.debug(
-                "File `%s` found in content cache." % filename)
+                "File `%s` found in content cache.", filename)
             return True
 
         # Check S3
@@ -171,7 +175,7 @@ class S3Listener(BaseListener):
         """Write `string` data to S3 with name `filename`"""
         if skip_if_exists and self._exists_on_s3(filename):
             self.logger.debug(
-                "File `%s` already exists on s3, skipping..." % filename)
+                "File `%s` already exists on s3, skipping...", filename)
             return
         if not isinstance(string, bytes):
             string = string.encode('utf-8')
@@ -187,7 +191,7 @@ class S3Listener(BaseListener):
         try:
             self._s3.upload_fileobj(out_f, self._bucket, filename)
             self.logger.debug(
-                "Successfully uploaded file `%s` to S3." % filename)
+                "Successfully uploaded file `%s` to S3.", filename)
             # Cache the filenames that are already on S3
             # We strip the bucket name as its the same for all files
             if skip_if_exists:
@@ -256,31 +260,29 @@ class S3Listener(BaseListener):
             return
         self._last_record_received = time.time()
         table, data = record
-        if table == "create_table":  # drop these statements
-            return
-        elif table == RECORD_TYPE_CONTENT:
-            self.process_content(record)
+        if self.handle_record(record):
             return
 
         # All data records should be keyed by the crawler and site visit
-        try:
-            visit_id = data['visit_id']
-        except KeyError:
-            self.logger.error("Record for table %s has no visit id" % table)
-            self.logger.error(json.dumps(data))
+        visit_id = data.get('visit_id')
+        if visit_id is None:
+            self.logger.error("Record for table %s has no visit id", table)
+            if self.logger.isEnabledFor(logging.ERROR):
+                self.logger.error(json.dumps(data))
             return
-        try:
-            crawl_id = data['crawl_id']
-        except KeyError:
-            self.logger.error("Record for table %s has no crawl id" % table)
-            self.logger.error(json.dumps(data))
+        crawl_id = data.get('crawl_id')
+        if crawl_id is None:
+            self.logger.error("Record for table %s has no crawl id", table)
+            if self.logger.isEnabledFor(logging.ERROR):
+                self.logger.error(json.dumps(data))
             return
 
         # Check if the browser for this record has moved on to a new visit
-        if crawl_id not in self.browser_map:
+        prev_visit_id = self.browser_map.get(crawl_id)
+        if prev_visit_id is None:
             self.browser_map[crawl_id] = visit_id
-        elif self.browser_map[crawl_id] != visit_id:
-            self._create_batch(self.browser_map[crawl_id])
+        elif prev_visit_id != visit_id:
+            self._create_batch(prev_visit_id)
             self._send_to_s3()
             self.browser_map[crawl_id] = visit_id
 
@@ -1,56 +1,140 @@
 import json
+import logging
+import selectors
 import socket
 import struct
+import sys
 import threading
+import time
 import traceback
-from queue import Queue
+from queue import Full, Queue
 
 import dill
 
-# TODO - Implement a cleaner shutdown for server socket
-# see: https://stackoverflow.com/a/1148237
+INITIAL_BUFFER_SIZE = 4096  # bytes, per connection
+MAX_MESSAGE_SIZE = 256 * 2 ** 20  # bytes, larger messages drop the client
+HEADER_SIZE = struct.calcsize('>Lc')
 
 
-class serversocket:
+class _Connection:
+    """State of a client connection to a `serversocket` shard"""
+
+    def __init__(self, address):
+        self.address = address
+        # Receive buffer, reused for the lifetime of the connection. It is
+        # grown geometrically as data arrives, up to the size of the largest
+        # message received.
+        self.buffer = bytearray(INITIAL_BUFFER_SIZE)
+        self.used = 0  # number of bytes in `buffer` not yet consumed
+
+    def reserve(self, size):
+        """Grow the buffer so that it can hold at least `size` bytes"""
+        capacity = len(self.buffer)
+        if capacity < size:
+            self.buffer.extend(bytes(max(size, 2 * capacity) - capacity))
+
+
+class _Shard:
     """
-    A server socket to receive and process string messages
-    from client sockets to a central queue
+    A listening socket of a `serversocket` and the thread which accepts and
+    reads its connections
     """
 
-    def __init__(self, name=None, verbose=False):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.bind(('localhost', 0))
-        self.sock.listen(10)  # queue a max of n connect requests
+    def __init__(self, sock, queue, name, verbose):
+        self.sock = sock
+        self.sock.setblocking(False)
         self.verbose = verbose
         self.name = name
-        self.queue = Queue()
-        if self.verbose:
-            print("Server bound to: " + str(self.sock.getsockname()))
+        self.queue = queue
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._accepting = False
+        self._thread = None
+        self.full_count = 0  # number of times a message found the queue full
+        self.logger = logging.getLogger('openwpm')
 
-    def start_accepting(self):
+    def start(self):
         """ Start the listener thread """
-        thread = threading.Thread(target=self._accept, args=())
+        self._selector.register(self.sock, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._accepting = True
+        thread = threading.Thread(target=self._serve, args=())
         thread.daemon = True  # stops from blocking shutdown
         if self.name is not None:
             thread.name = thread.name + "-" + self.name
         thread.start()
+        self._thread = thread
+
+    def _serve(self):
+        """
+        Accept connections and read messages from all of them in a single
+        thread. Runs until accepting is stopped and every client has closed
+        its connection.
+        """
+        while self._accepting or len(self._selector.get_map()) > 1:
+            for key, _ in self._selector.select():
+                if key.fileobj is self.sock:
+                    self._accept()
+                elif key.fileobj is self._wakeup_r:
+                    self._stop()
+                else:
+                    # An error on one connection must not stop the others
+                    try:
+                        self._read(key.fileobj, key.data)
+                    except Exception:
+                        self.logger.error(
+                            "Error while reading from %s, closing the "
+                            "connection.", key.data.address, exc_info=True)
+                        self._close_conn(key.fileobj, key.data)
+        self._close_selector()
+
+    def _close_selector(self):
+        """ Close the selector and both ends of the wakeup socketpair """
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
 
     def _accept(self):
-        """ Listen for connections and pass handling to a new thread """
-        while True:
-            try:
-                (client, address) = self.sock.accept()
-                thread = threading.Thread(target=self._handle_conn,
-                                          args=(client, address))
-                thread.daemon = True
-                thread.start()
-            except ConnectionAbortedError:
-                # Workaround for #278
-                print("A connection establish request was performed "
-                      "on a closed socket")
-                return
+        """ Accept a new connection and register it with the selector.
+        Returns `False` if there was no pending connection. """
+        try:
+            (client, address) = self.sock.accept()
+        except BlockingIOError:
+            return False
+        except Exception:
+            self.logger.error(
+                "Error while accepting a connection on the %s socket.",
+                self.name, exc_info=True)
+            return False
+        client.setblocking(False)
+        self._selector.register(
+            client, selectors.EVENT_READ, _Connection(address))
+        if self.verbose:
+            print("Connected to: %s" % (address,))
+        return True
+
+    def _stop(self):
+        """ Stop accepting connections. Called on the listener thread """
+        self._wakeup_r.recv(1)
+        if not self._accepting:
+            return
+        self._accepting = False
+        # Connections still in the backlog would be reset by the close
+        while self._accept():
+            pass
+        self._selector.unregister(self.sock)
+        self.sock.close()
 
-    def _handle_conn(self, client, address):
+    def _close_conn(self, client, conn):
+        try:
+            self._selector.unregister(client)
+        except KeyError:
+            pass  # already closed
+        client.close()
+        if self.verbose:
+            print("Client socket: " + str(conn.address) + " closed")
+
+    def _read(self, client, conn):
         """
         Receive messages and pass to queue. Messages are prefixed with
         a 4-byte integer to specify the message length and 1-byte character
@@ -62,49 +146,185 @@ class serversocket:
             'd' : dill pickle
             'j' : json
         """
-        if self.verbose:
-            print("Thread: %s connected to: %s" %
-                  (threading.current_thread(), address))
+        if conn.used == len(conn.buffer):
+            conn.reserve(conn.used + 1)
         try:
-            while True:
-                msg = self.receive_msg(client, 5)
-                msglen, serialization = struct.unpack('>Lc', msg)
+            with memoryview(conn.buffer) as view:
+                nbytes = client.recv_into(view[conn.used:])
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            nbytes = 0
+        if nbytes == 0:
+            self._close_conn(client, conn)
+            return
+        conn.used += nbytes
+
+        # Deserialize complete messages straight from the buffer and move
+        # any trailing partial message to the front. The view must be
+        # released before the buffer can be resized.
+        offset = 0
+        with memoryview(conn.buffer) as view:
+            while conn.used - offset >= HEADER_SIZE:
+                msglen, serialization = struct.unpack_from(
+                    '>Lc', view, offset)
+                if msglen > MAX_MESSAGE_SIZE:
+                    self.logger.error(
+                        "Message of %d bytes from %s exceeds the maximum "
+                        "size of %d bytes, closing the connection.",
+                        msglen, conn.address, MAX_MESSAGE_SIZE)
+                    view.release()
+                    self._close_conn(client, conn)
+                    return
+                start = offset + HEADER_SIZE
+                if conn.used - start < msglen:
+                    break
                 if self.verbose:
                     print("Received message, length %d, serialization %r"
                           % (msglen, serialization))
-                msg = self.receive_msg(client, msglen)
-                if serialization != b'n':
-                    try:
-                        if serialization == b'd':  # dill serialization
-                            msg = dill.loads(msg)
-                        elif serialization == b'j':  # json serialization
-                            msg = json.loads(msg.decode('utf-8'))
-                        elif serialization == b'u':  # utf-8 serialization
-                            msg = msg.decode('utf-8')
-                        else:
-                            print("Unrecognized serialization type: %r"
-                                  % serialization)
-                            continue
-                    except (UnicodeDecodeError, ValueError) as e:
-                        print("Error de-serializing message: %s \n %s" % (
-                            msg, traceback.format_exc(e)))
-                        continue
-                self.queue.put(msg)
-        except RuntimeError:
-            if self.verbose:
-                print("Client socket: " + str(address) + " closed")
-
-    def receive_msg(self, client, msglen):
-        msg = b''
-        while len(msg) < msglen:
-            chunk = client.recv(msglen - len(msg))
-            if not chunk:
-                raise RuntimeError("socket connection broken")
-            msg = msg + chunk
-        return msg
+                self._put_msg(view[start:start + msglen], serialization)
+                offset = start + msglen
+            remaining = conn.used - offset
+            if offset > 0 and remaining > 0:
+                view[:remaining] = view[offset:conn.used]
+        conn.used = remaining
+
+    def _put_msg(self, view, serialization):
+        """ Deserialize the message in memoryview `view` and pass it to the
+        queue. `view` is only valid for the duration of this call. """
+        if serialization == b'n':
+            msg = bytes(view)
+        else:
+            try:
+                if serialization == b'd':  # dill serialization
+                    msg = dill.loads(view)
+                elif serialization == b'j':  # json serialization
+                    msg = json.loads(str(view, 'utf-8'))
+                elif serialization == b'u':  # utf-8 serialization
+                    msg = str(view, 'utf-8')
+                else:
+                    print("Unrecognized serialization type: %r"
+                          % serialization)
+                    return
+            except Exception:
+                print("Error de-serializing message: %s \n %s" % (
+                    bytes(view), traceback.format_exc()))
+                return
+        try:
+            self.queue.put_nowait(msg)
+        except Full:
+            # Block until the consumer catches up. Meanwhile nothing is read
+            # from this shard's clients, which pushes back on their sends.
+            self.full_count += 1
+            self.queue.put(msg)
+
+    def join(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for the listener thread to exit.
+        Returns `False` if it is still running.
+        """
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def stop(self):
+        """
+        Stop accepting new connections. Connections which are already open
+        are still read until their clients close them.
+        """
+        if self._thread is None:
+            self.sock.close()
+            self._close_selector()
+        elif self._thread.is_alive():
+            try:
+                self._wakeup_w.send(b'\0')
+            except OSError:
+                pass  # the listener thread exited in the meantime
+
+
+class serversocket:
+    """
+    A server socket to receive and process string messages
+    from client sockets to a central queue
+
+    On Linux, with `nshards` > 1, `nshards` sockets are bound to the same
+    port with `SO_REUSEPORT` and the kernel balances incoming connections
+    across them. Each socket is served by its own thread. Other platforms
+    (e.g. macOS) don't balance TCP connections across `SO_REUSEPORT`
+    sockets, so a single socket is used there.
+
+    If `maxsize` is greater than 0 the queue is bounded, and reading from
+    the clients stops while it is full.
+    """
+
+    def __init__(self, name=None, verbose=False, nshards=1, maxsize=0):
+        if not sys.platform.startswith('linux'):
+            nshards = 1
+        socks = list()
+        address = ('localhost', 0)
+        for i in range(nshards):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if nshards > 1:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(address)
+            sock.listen(10)  # queue a max of n connect requests
+            address = sock.getsockname()
+            socks.append(sock)
+        self.sock = socks[0]
+        self.verbose = verbose
+        self.name = name
+        self.queue = Queue(maxsize)
+        self._shards = [
+            _Shard(sock, self.queue, name, verbose) for sock in socks]
+        if self.verbose:
+            print("Server bound to: " + str(self.sock.getsockname()))
+
+    def start_accepting(self):
+        """ Start the listener threads """
+        for shard in self._shards:
+            shard.start()
+
+    @property
+    def full_count(self):
+        """Number of messages which had to wait for space in the queue"""
+        return sum(shard.full_count for shard in self._shards)
+
+    def stop_accepting_and_join(self, timeout=None):
+        """
+        Stop accepting new connections and wait up to `timeout` seconds for
+        the open connections to be closed by their clients. Once this
+        returns `True`, every message sent on those connections is in the
+        queue. Returns `False` if some connections are still open.
+
+        If the queue is bounded, it must be consumed concurrently. Otherwise
+        use `close` and `join` instead.
+        """
+        self.close()
+        return self.join(timeout)
+
+    def join(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for the open connections to be closed
+        by their clients, after `close` was called. Returns `False` if some
+        connections are still open.
+        """
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        for shard in self._shards:
+            if timeout is not None:
+                timeout = max(0, deadline - time.monotonic())
+            if not shard.join(timeout):
+                return False
+        return True
 
     def close(self):
-        self.sock.close()
+        """
+        Stop accepting new connections. Connections which are already open
+        are still read until their clients close them.
+        """
+        for shard in self._shards:
+            shard.stop()
 
 
 class clientsocket:
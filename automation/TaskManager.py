@@ -243,7 +243,9 @@ class TaskManager:
             'aggregator_address'] = self.data_aggregator.listener_address
 
         # open connection to aggregator for saving crawl details
-        self.sock = clientsocket(serialization='dill')
+        # records are plain JSON types, which avoids dill's pure-Python
+        # pickler on every command
+        self.sock = clientsocket(serialization='json')
         self.sock.connect(*self.manager_params['aggregator_address'])
 
     def _shutdown_manager(self, during_init=False):
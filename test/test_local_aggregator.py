@@ -0,0 +1,97 @@
+import os
+import sqlite3
+
+import pytest
+
+from ..automation.DataAggregator.LocalAggregator import LocalListener
+
+
+@pytest.fixture
+def listener(tmpdir):
+    manager_params = {
+        'database_name': os.path.join(str(tmpdir), 'crawl-data.sqlite'),
+        'data_directory': str(tmpdir),
+        'aggregator_socket_shards': 1,
+    }
+    listener = LocalListener(None, None, manager_params, ldb_enabled=False)
+    listener.process_record((
+        'create_table',
+        "CREATE TABLE test (id INTEGER PRIMARY KEY, a TEXT, b TEXT)"
+    ))
+    yield listener
+    listener.db.close()
+
+
+class TestLocalListener(object):
+
+    def test_process_records(self, listener):
+        listener.process_records([
+            ('test', {'id': 1, 'a': 'one'}),
+            ('test', {'id': 2, 'a': 'two'}),
+            ('test', {'id': 1, 'a': 'duplicate'}),  # UNIQUE violation
+            ('test', {'id': 3, 'a': 'three'}),
+            ('test', {'id': 4, 'b': b'four'}),  # different columns
+            ('test', {'id': 5, 'a': 'five', 'b': 'five'}),
+            ('missing', {'id': 1}),  # table doesn't exist
+            ('missing', {'id': 2}),
+            ('test', {'id': 6, 'a': {'key': 'value'}}),
+        ])
+        assert listener._sql_counter == 6
+        # Rows are only committed by `maybe_commit_records`
+        assert listener.db.in_transaction
+        listener.db.commit()
+
+        listener.cur.execute("SELECT id, a, b FROM test ORDER BY id")
+        assert listener.cur.fetchall() == [
+            (1, 'one', None),
+            (2, 'two', None),
+            (3, 'three', None),
+            (4, None, 'four'),
+            (5, 'five', 'five'),
+            (6, '{"key": "value"}', None),
+        ]
+
+    def test_failed_row_is_skipped(self, listener, caplog):
+        listener.process_records([('test', {'id': 1, 'a': 'one'})])
+        listener.process_records([
+            ('test', {'id': 2, 'a': 'two'}),
+            ('test', {'id': 1, 'a': 'duplicate'}),
+            ('test', {'id': 3, 'a': 'three'}),
+            ('test', {'id': 2, 'a': 'duplicate'}),
+            ('test', {'id': 4, 'a': 'four'}),
+        ])
+        assert listener._sql_counter == 4
+        errors = [record for record in caplog.records
+                  if record.levelname == 'ERROR']
+        assert [record.args[-1] for record in errors] == [
+            [1, 'duplicate'], [2, 'duplicate']]
+        listener.db.commit()
+        listener.cur.execute("SELECT id, a FROM test ORDER BY id")
+        assert listener.cur.fetchall() == [
+            (1, 'one'), (2, 'two'), (3, 'three'), (4, 'four')]
+
+    def test_invalid_statement(self, listener, caplog):
+        listener.process_records([
+            ('missing', {'id': 1}),
+            ('missing', {'id': 2}),
+        ])
+        assert listener._sql_counter == 0
+        errors = [record for record in caplog.records
+                  if record.levelname == 'ERROR']
+        assert [record.args[-1] for record in errors] == [[1], [2]]
+
+    def test_registered_handler(self, listener):
+        handled = list()
+        listener.register_handler('custom', handled.append)
+        listener.process_records([
+            ('custom', {'id': 1}),
+            ('test', {'id': 1, 'a': 'one'}),
+            ('custom', {'id': 2}),
+        ])
+        listener.process_record(('custom', {'id': 3}))
+        assert handled == [
+            ('custom', {'id': 1}), ('custom', {'id': 2}), ('custom', {'id': 3})
+        ]
+        assert listener._sql_counter == 1
+        with pytest.raises(sqlite3.OperationalError):
+            listener.cur.execute("SELECT * FROM custom")
@@ -0,0 +1,220 @@
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+
+import dill
+import pytest
+
+from ..automation import SocketInterface
+from ..automation.SocketInterface import clientsocket, serversocket
+
+TIMEOUT = 5  # seconds
+
+
+def _frame(payload, serialization):
+    return struct.pack('>Lc', len(payload), serialization) + payload
+
+
+def _get_all(server, count):
+    return [server.queue.get(timeout=TIMEOUT) for _ in range(count)]
+
+
+@pytest.fixture
+def server():
+    server = serversocket(name='test')
+    server.start_accepting()
+    yield server
+    server.close()
+
+
+class TestSocketInterface(object):
+
+    def test_serialization_types(self, server):
+        sock = socket.create_connection(server.sock.getsockname())
+        sock.sendall(b''.join([
+            _frame(b'raw bytes', b'n'),
+            _frame('unicode é'.encode('utf-8'), b'u'),
+            _frame(json.dumps({'a': [1, 2]}).encode('utf-8'), b'j'),
+            _frame(dill.dumps(('table', {'b': b'x'})), b'd'),
+        ]))
+        sock.close()
+        assert _get_all(server, 4) == [
+            b'raw bytes', 'unicode é', {'a': [1, 2]},
+            ('table', {'b': b'x'})
+        ]
+
+    def test_clientsocket(self, server):
+        for serialization in ['json', 'dill']:
+            client = clientsocket(serialization=serialization)
+            client.connect(*server.sock.getsockname())
+            client.send(('table', {'visit_id': 1}))
+            client.send('string')
+            client.close()
+            record, string = _get_all(server, 2)
+            assert list(record) == ['table', {'visit_id': 1}]
+            assert string == 'string'
+
+    def test_partial_frames(self, server):
+        data = _frame(b'first', b'n') + _frame(b'second', b'n')
+        sock = socket.create_connection(server.sock.getsockname())
+        for i in range(len(data)):
+            sock.sendall(data[i:i + 1])
+        sock.close()
+        assert _get_all(server, 2) == [b'first', b'second']
+
+    def test_message_larger_than_buffer(self, server):
+        payload = b'x' * (10 * SocketInterface.INITIAL_BUFFER_SIZE + 1)
+        sock = socket.create_connection(server.sock.getsockname())
+        sock.sendall(_frame(payload, b'n') + _frame(b'after', b'n'))
+        sock.close()
+        assert _get_all(server, 2) == [payload, b'after']
+
+    def test_oversized_message_drops_client(self, server):
+        good = socket.create_connection(server.sock.getsockname())
+        bad = socket.create_connection(server.sock.getsockname())
+        bad.sendall(struct.pack(
+            '>Lc', SocketInterface.MAX_MESSAGE_SIZE + 1, b'n'))
+        bad.settimeout(TIMEOUT)
+        assert bad.recv(1) == b''
+        good.sendall(_frame(b'message', b'n'))
+        assert server.queue.get(timeout=TIMEOUT) == b'message'
+        bad.close()
+        good.close()
+
+    def test_concurrent_clients(self, server):
+        num_clients = 8
+        num_messages = 500
+
+        def send(index):
+            client = clientsocket()
+            client.connect(*server.sock.getsockname())
+            for i in range(num_messages):
+                client.send([index, i])
+            client.close()
+
+        threads = [threading.Thread(target=send, args=(index,))
+                   for index in range(num_clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        received = dict()
+        for index, i in _get_all(server, num_clients * num_messages):
+            received.setdefault(index, list()).append(i)
+        assert received == {
+            index: list(range(num_messages)) for index in range(num_clients)
+        }
+
+    def test_bounded_queue(self):
+        server = serversocket(name='test', maxsize=5)
+        server.start_accepting()
+        sock = socket.create_connection(server.sock.getsockname())
+        sock.sendall(b''.join(_frame(str(i).encode('utf-8'), b'u')
+                              for i in range(20)))
+        # The reader blocks once the queue is full and counts the event
+        deadline = time.time() + TIMEOUT
+        while not (server.queue.full() and server.full_count > 0):
+            assert time.time() < deadline
+            time.sleep(0.01)
+        assert server.queue.qsize() == 5
+        assert _get_all(server, 20) == [str(i) for i in range(20)]
+        assert server.full_count >= 1
+        sock.close()
+        assert server.stop_accepting_and_join(TIMEOUT)
+
+    def test_unbounded_queue_is_never_full(self, server):
+        sock = socket.create_connection(server.sock.getsockname())
+        sock.sendall(b''.join(_frame(b'x', b'n') for i in range(1000)))
+        sock.close()
+        assert len(_get_all(server, 1000)) == 1000
+        assert server.full_count == 0
+
+    def test_close_and_join(self, server):
+        address = server.sock.getsockname()
+        sock = socket.create_connection(address)
+        server.close()
+        # Open connections are still read after `close`
+        assert not server.join(0.1)
+        sock.sendall(_frame(b'late', b'n'))
+        assert server.queue.get(timeout=TIMEOUT) == b'late'
+        with pytest.raises(ConnectionRefusedError):
+            socket.create_connection(address)
+        sock.close()
+        assert server.join(TIMEOUT)
+
+    def test_stop_accepting_and_join(self, server):
+        sock = socket.create_connection(server.sock.getsockname())
+        sock.sendall(_frame(b'message', b'n'))
+        assert not server.stop_accepting_and_join(0.1)
+        sock.close()
+        assert server.stop_accepting_and_join(TIMEOUT)
+        assert server.queue.get_nowait() == b'message'
+
+    def test_close_before_start(self):
+        server = serversocket()
+        server.close()
+        assert server.join(0)
+        assert server.stop_accepting_and_join(0)
+
+    def test_bad_client_does_not_stop_others(self, server, monkeypatch):
+        put_msg = SocketInterface._Shard._put_msg
+
+        def failing_put_msg(self, view, serialization):
+            if bytes(view) == b'fail':
+                raise RuntimeError("Test failure")
+            put_msg(self, view, serialization)
+        monkeypatch.setattr(
+            SocketInterface._Shard, '_put_msg', failing_put_msg)
+
+        good = socket.create_connection(server.sock.getsockname())
+        bad = socket.create_connection(server.sock.getsockname())
+        good.sendall(_frame(b'before', b'n'))
+        assert server.queue.get(timeout=TIMEOUT) == b'before'
+        bad.sendall(_frame(b'fail', b'n'))
+        # The server closes the failing connection only
+        bad.settimeout(TIMEOUT)
+        assert bad.recv(1) == b''
+        good.sendall(_frame(b'after', b'n'))
+        assert server.queue.get(timeout=TIMEOUT) == b'after'
+        bad.close()
+        good.close()
+        assert server.stop_accepting_and_join(TIMEOUT)
+
+    def test_bad_serialization_is_skipped(self, server):
+        sock = socket.create_connection(server.sock.getsockname())
+        sock.sendall(b''.join([
+            _frame(b'not a pickle', b'd'),
+            _frame(b'{', b'j'),
+            _frame(b'unknown', b'x'),
+            _frame(b'valid', b'n'),
+        ]))
+        sock.close()
+        assert server.queue.get(timeout=TIMEOUT) == b'valid'
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'),
+                        reason="socket sharding is only used on Linux")
+    def test_sharded_server(self):
+        server = serversocket(name='test', nshards=4)
+        server.start_accepting()
+        address = server.sock.getsockname()
+        assert all(shard.sock.getsockname() == address
+                   for shard in server._shards)
+        clients = list()
+        for index in range(16):
+            client = clientsocket()
+            client.connect(*address)
+            clients.append(client)
+        for i in range(100):
+            for index, client in enumerate(clients):
+                client.send([index, i])
+        for client in clients:
+            client.close()
+        assert server.stop_accepting_and_join(TIMEOUT)
+        received = dict()
+        while not server.queue.empty():
+            index, i = server.queue.get_nowait()
+            received.setdefault(index, list()).append(i)
+        assert received == {index: list(range(100)) for index in range(16)}